@@ -5,8 +5,8 @@ def FUC_curve_generator(FUC_data, min_time_breakpoint, ignoreFirst = False):
     """
     Isolates and returns FUC curve indicies from a time series of FUC curves.
     
-    :param FUC_data: chronologically ordered numpy array with [datetime, FUC xCO2 data] columns. Datetime column
-                     should be populated with datetime objects
+    :param FUC_data: chronologically ordered numpy array of the datetimes of FUC xCO2 data. Should be datetime64,
+                     so that time differences are computed natively rather than between datetime objects.
     :param min_time_breakpoint: numpy timedelta64 object determinining the minimum time between two measurements
                                 which constitutes a new FUC curve.
     :param ignoreFirst: Do not return the first FUC curve. This is for when it is likely the data starts with a
@@ -16,21 +16,15 @@ def FUC_curve_generator(FUC_data, min_time_breakpoint, ignoreFirst = False):
     :return: yields indicies of isolated FUC curve
     """
     
-    i = 0  # lagging frame
-    j = 1  # leading frame
-    while j < FUC_data.shape[0]:
-        if abs(FUC_data[j] - FUC_data[j - 1]) > min_time_breakpoint:
-            if not ignoreFirst:
-                yield i, j - 1
-                i = j
-                j += 1
-            else:
-                ignoreFirst = False
-                i = j
-                j += 1
-        else:
-            j += 1
-    yield i, j - 1
+    num_points = max(FUC_data.shape[0], 1)
+    breaks = np.flatnonzero(np.abs(np.diff(FUC_data)) > min_time_breakpoint) + 1  # first index of each new curve
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [num_points]))
+    if ignoreFirst and breaks.size > 0:
+        starts = starts[1:]
+        ends = ends[1:]
+    for i, j in zip(starts, ends):
+        yield int(i), int(j) - 1
 
 
 def FUC_tests(FUC_curve, span_co2: float, min_num_points: int, max_diff_from_span: float, max_st_dev: float) -> bool:
@@ -69,8 +63,8 @@ def FUC_tests(FUC_curve, span_co2: float, min_num_points: int, max_diff_from_spa
 
 def qc_FUC_timeseries(FUC_time_series, min_time_breakpoint, span_co2, min_num_points=10, max_diff_from_span=5, max_st_dev=2.25, ignoreFirst=False):
     """
-    Isolates each FUC curve of FUC_time_series and applies a flag determined by the FUC_tests function. Outputs an array
-    of [timestamp, flag] for each identified FUC curve. If ignoreFirst is true, then skips the first FUC curve identified
+    Isolates each FUC curve of FUC_time_series and applies a flag determined by the FUC_tests function. Outputs a record
+    array of (timestamp, flag) for each identified FUC curve. If ignoreFirst is true, then skips the first FUC curve identified
     (in case that curve is incomplete).
 	
     :param FUC_time_series: (numpy array) chronologically ordered numpy array with [datetime, FUC xCO2 data] columns
@@ -87,18 +81,31 @@ def qc_FUC_timeseries(FUC_time_series, min_time_breakpoint, span_co2, min_num_po
                         partial FUC curve (preferably one that has already been flagged), so flagging should not
                         be performed.
 
-	:return: Numpy array of [timestamp, FUC flag] for each unique FUC curve identified (not per datetime in FUC_time_series).
-	         Timestamp is first datetime of FUC curve.
+	:return: Numpy record array with 'timestamp' (datetime64[ns]) and 'flag' (bool) fields for each unique FUC curve
+	         identified (not per datetime in FUC_time_series). Timestamp is first datetime of FUC curve.
     """
     
-    generator = FUC_curve_generator(FUC_time_series[:, 0], min_time_breakpoint, ignoreFirst)
-    output = []
-    for curve_start, curve_end in generator:
-        if curve_end - curve_start == 0:
-            # failsafe if curve is ever only one point, since a slice must have its first and second indicies be different
-            curve_end += 1
-        timestamp = FUC_time_series[curve_start, 0]
-        flag = FUC_tests(FUC_time_series[curve_start:curve_end, 1], span_co2, min_num_points, max_diff_from_span, max_st_dev)
-        output.append([timestamp, flag])
-    return np.array(output)
+    times = FUC_time_series[:, 0].astype('datetime64[ns]')
+    curves = np.array(list(FUC_curve_generator(times, np.timedelta64(min_time_breakpoint, 'ns'), ignoreFirst)))
+    curve_starts = curves[:, 0]
+    # failsafe if curve is ever only one point, since a slice must have its first and second indicies be different
+    curve_ends = np.where(curves[:, 1] == curve_starts, curves[:, 1] + 1, curves[:, 1])
+    curve_lengths = curve_ends - curve_starts
+    xco2 = FUC_time_series[:, 1].astype(float)
+
+    # curves long enough for a full [-8:-3] window are tested together; shorter curves fall back to FUC_tests
+    full = curve_lengths >= 8
+    flags = np.empty(curves.shape[0], dtype=bool)
+    flags[full] = curve_lengths[full] < min_num_points
+    # as in FUC_tests, a curve only goes through a test if it passed the ones before it
+    tested = np.flatnonzero(full & ~flags)
+    last_FUC_measurements = xco2[curve_ends[tested, np.newaxis] + np.arange(-8, -3)]
+    flags[tested] = np.abs(span_co2 - last_FUC_measurements.mean(axis=1)) > max_diff_from_span
+    passed = ~flags[tested]
+    flags[tested[passed]] = last_FUC_measurements[passed].std(axis=1) > max_st_dev
+    for idx in np.flatnonzero(~full):
+        flags[idx] = FUC_tests(xco2[curve_starts[idx]:curve_ends[idx]], span_co2, min_num_points, max_diff_from_span,
+                               max_st_dev)
+
+    return np.rec.fromarrays([times[curve_starts], flags], names='timestamp,flag')
 
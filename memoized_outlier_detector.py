@@ -1,10 +1,15 @@
 # standard packages
-from copy import copy
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import itertools
 import math
 
 # 3rd party packages
 import numpy as np
 
+_INV_IQR_SIGMA = 1.0 / 1.349  # ratio of the standard deviation to the interquartile range of a normal distribution
+_CHUNK_SIZE = 4096  # at most _CHUNK_SIZE frames are copied out of the sliding-window view and sorted at once
+
 
 class OutlierDetector:
     """
@@ -12,76 +17,83 @@ class OutlierDetector:
     the ability to specify how many sweeps of the data should be performed to detect outliers.
     """
     
-    def __init__(self, generator_factory, outlier_algorithm):
+    def __init__(self, generator_factory, outlier_algorithm, num_threads=1):
         """
-        :param generator_factory: (object) produces a generator that partitions the data into subsections
-                                  according to the generator's business rules (ex. using a range or number of frames)
+        :param generator_factory: (object) partitions the data into frames according to the factory's business rules
+                                  (ex. using a range or number of frames). Should have .frames(data), returning the frames
+                                  and the index of the frame used for each datum, and .span() methods.
         :param outlier_algorithm: (object) contains the method to determine outliers (ex. interquartile range, z-score)
+        :param num_threads: (int) number of threads across which the independent columns of data are split. A single
+                            thread pool is shared by all sweeps.
         """
         
         self._generator_factory = generator_factory
         self._outlier_algorithm = outlier_algorithm
+        self._num_threads = num_threads
 
     def outliers(self, data, num_of_iterations=None):
         """
         Detects outliers using provided statistical methods.
         
         :param data: (numpy array) time series data organized in columns, where each column is an independent time series and time ordered.
-                     Timestamp data should not be included.
+                     Timestamp data should not be included. 1D data are treated as a single column.
         :param num_of_iterations: (int) number of sweeps of the outlier detector over the data. Previously found outliers will be removed so
                                   that new outliers which might have been missed because of other outliers can be detected. If None, the algorithm
                                   will continue to sweep the data until no further outliers are detected.
         
         :return: (boolean array) trues indicate detected outliers.
         """
-        if len(data.shape) == 1:
-            data = np.reshape(np.array(data), (-1, 1))
+        # single contiguous 2D working buffer (1D data become one column); outliers are set to NaN in place between sweeps
+        data = np.array(data, dtype=np.float64, order='C')
+        if data.ndim == 1:
+            data = data.reshape(-1, 1)
         
-        outliers = np.zeros(data.shape)
-        num_missing_in_frame = np.zeros(data.shape)
-        if num_of_iterations is None:
-            while True:
-                outlier_truth_matrix, num_missing_in_frame = self._outlier_algorithm.outliers(copy(data),
-                                                                                              self._generator_factory,
-                                                                                              num_missing_in_frame)
-                outliers += outlier_truth_matrix
-                if np.sum(outlier_truth_matrix) == 0:
+        outliers = np.zeros(data.shape, dtype=bool)
+        outlier_truth_matrix = None  # nothing has been removed before the first sweep
+        num_threads = min(self._num_threads, data.shape[1])
+        executor = ThreadPoolExecutor(max_workers=num_threads) if num_threads > 1 else None
+        try:
+            sweeps = itertools.count() if num_of_iterations is None else range(num_of_iterations)
+            for _ in sweeps:
+                outlier_truth_matrix = self._outlier_algorithm.outliers(data, self._generator_factory, outlier_truth_matrix,
+                                                                        executor)
+                if not outlier_truth_matrix.any():
                     break
+                outliers |= outlier_truth_matrix
                 data[outlier_truth_matrix] = float('nan')
-            return outliers.astype(bool)
-        else:
-            for _ in range(num_of_iterations):
-                outlier_truth_matrix, num_missing_in_frame = self._outlier_algorithm.outliers(copy(data),
-                                                                                              self._generator_factory,
-                                                                                              num_missing_in_frame)
-                outliers += outlier_truth_matrix
-                if np.sum(outlier_truth_matrix) == 0:
-                    break
-                data[outlier_truth_matrix] = float('nan')
-            return outliers.astype(bool)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return outliers
 
 
 class byFrameGeneratorFactory:
     """
     Generator Factory.
-    For each datum, generator yields a subset of data that are within 'frame' positions from the datum.
-    Since a symmetric frame cannot be built for data at the beginning and end of the dataset, the data
-    yielded will be the first/last 2 * frame + 1 measurements.
+    For each datum, the frame is the subset of data that are within 'frame' positions from the datum.
+    Since a symmetric frame cannot be built for data at the beginning and end of the dataset, the frame
+    used will be the first/last 2 * frame + 1 measurements.
     """
 
     def __init__(self, frame=8):
         self._frame = math.ceil(frame)
 
-    def generator(self, data):
-        data = copy(data)
-        for idx in range(data.shape[0]):
-            if self._frame <= idx < (data.shape[0] - self._frame):
-                output = data[(idx - self._frame):(idx + self._frame + 1), ]
-            elif idx < self._frame:
-                output = data[:(2 * self._frame + 1), ]
-            else:
-                output = data[(-2 * self._frame - 1):, ]
-            yield output
+    def frames(self, data):
+        """
+        Builds every distinct frame of data in a single pass, rather than one frame per datum. Data at the beginning and
+        end of the dataset share the first/last frame.
+
+        :param data: (2D numpy array) time series data organized in columns.
+
+        :return: (array, integer array) read-only view of the frames, of shape (number of frames, number of columns,
+                 frame width), and, for each datum, the index of the frame it belongs to.
+        """
+
+        width = min(2 * self._frame + 1, data.shape[0])
+        num_frames = data.shape[0] - width + 1
+        frames = np.lib.stride_tricks.sliding_window_view(data, width, axis=0)
+        frame_index = np.clip(np.arange(data.shape[0]) - self._frame, 0, num_frames - 1)
+        return frames, frame_index
 
     def span(self):
         return self._frame
@@ -103,60 +115,91 @@ class InterquartileVarianceAlgorithm:
         self._stdev_limit = stdev_limit
         self._min_num_points = min_num_points  # minimum number of data necessary for statistics
 
-    def outliers(self, data, generator_factory, num_missing_data_in_frame):
+    def outliers(self, data, generator_factory, previous_outliers=None, executor=None):
         """
         Creates a boolean matrix of detected outliers.
         
-        :param data: (array like) Time-series data which has been sorted by time. Non-data columns (ex. time) should not be included.
+        :param data: (2D float array) Time-series data which has been sorted by time. Non-data columns (ex. time) should not be included.
                      Each column of data is treated as independent. 
-        :param generator_factory: (class object) a factory which creates a data generator used to break up the data for statistical analysis.
-                                  Should have .outlier(data) method.
-        :param num_missing_data_in_frame: (integer array) memoization array tracking the number of nan values within a given generator frame.
-                                          If the number of nan values has not changed from a previous iteration, the statistics will be skipped
-                                          (as nothing has changed). Should be all zeros when beginning method.
+        :param generator_factory: (class object) a factory which breaks up the data into frames for statistical analysis.
+                                  Should have .frames(data) and .span() methods.
+        :param previous_outliers: (boolean array) memoization of the outliers detected (and since set to nan) by the previous sweep.
+                                  Frames containing none of them have not changed, so their statistics will be skipped (no new
+                                  outliers can be found in them). None for the first sweep, in which every frame is used.
+        :param executor: (concurrent.futures.Executor) if given, each column of data is evaluated as a separate task on it.
         
-        :return: (boolean array, integer array) trues indicate detected outliers in boolean array. Integer array is num_missing_data_in_frame.
+        :return: (boolean array) trues indicate detected outliers.
         """
         
-        span = generator_factory.span()  # position of the center point yielded by the generator
-        if len(data.shape) == 1:
-            data = np.reshape(np.array(data), (-1, 1))
-        outliers = np.zeros(data.shape)
-        generator = generator_factory.generator(data)
+        span = generator_factory.span()  # number of data on either side of the center point of a frame
+        frames, frame_index = generator_factory.frames(data)
 
         min_num_points = min(2 * span + 1, self._min_num_points)  # minimum number of non-NaN data to do statistics
-        for count, frame in enumerate(generator):
-            new_num_missing_data = [sum(~np.isnan(frame[:, i])) for i in range(frame.shape[1])]
-            need_recalc = [True if new_num_missing_data[i] != num_missing_data_in_frame[count, i] else False
-                           for i in range(len(new_num_missing_data))]
-            row_outliers = [is_outlier(frame[:, i], data[count, i], self._stdev_limit, min_num_points)
-                            if need_recalc[i] else False
-                            for i in range(frame.shape[1])]
-            if not np.array_equal(num_missing_data_in_frame[count], new_num_missing_data):
-                num_missing_data_in_frame[count] = new_num_missing_data
-            outliers[count] = row_outliers
-        return outliers.astype(bool), num_missing_data_in_frame
-
-
-def is_outlier(col, data_point, std_dev_limit, min_num_points):
+        if previous_outliers is None:
+            frame_changed = np.ones(frames.shape[0], dtype=bool)
+        else:
+            # frames i - width + 1 through i contain datum i (clamped to the first/last frame)
+            changed_rows = np.flatnonzero(previous_outliers.any(axis=1))
+            frame_changed = np.zeros(frames.shape[0], dtype=bool)
+            frame_changed[np.clip(changed_rows[:, np.newaxis] - np.arange(frames.shape[2]), 0, frames.shape[0] - 1)] = True
+        outliers = np.zeros(data.shape, dtype=bool)
+        rows = np.flatnonzero(frame_changed[frame_index])
+        if rows.size > 0:
+            row_frames = frame_index[rows]
+            if executor is None:
+                self._chunked_outliers(frames, data, rows, row_frames, min_num_points, outliers)
+            else:
+                column_outliers = functools.partial(self._chunked_outliers, frames, data, rows, row_frames, min_num_points,
+                                                    outliers)
+                list(executor.map(column_outliers, range(data.shape[1])))  # list() re-raises any error from a column
+        return outliers
+
+    def _chunked_outliers(self, frames, data, rows, row_frames, min_num_points, outliers, column=slice(None)):
+        """
+        Fills outliers[rows, column] by passing the frames of rows to is_outlier _CHUNK_SIZE rows at a time, so that only
+        one chunk of frames is ever copied out of the sliding window view (and sorted) at once. Non-NaN data are only counted
+        within those chunks, so a late sweep touching few frames does little work.
+        """
+
+        for start in range(0, rows.size, _CHUNK_SIZE):
+            chunk_rows = rows[start:start + _CHUNK_SIZE]
+            chunk_frames = row_frames[start:start + _CHUNK_SIZE]
+            outliers[chunk_rows, column] = is_outlier(frames[chunk_frames, column], data[chunk_rows, column],
+                                                      self._stdev_limit, min_num_points, axis=-1)
+
+
+def is_outlier(col, data_point, std_dev_limit, min_num_points, axis=0):
     """
     Estimates the variance of the col data using the interquartile range. Outputs whether data_point is outside
     median +/- std_dev_limit * estimated variance. min_num_points is used to make sure there is enough data to 
-    result in good statistics.
+    result in good statistics. Statistics are computed along axis, so a frame of several columns (or a stack of
+    frames) is evaluated in a single call.
     
     :param col: (array-like) data in question.
-    :param data_point: (float) datum to evaluate as outlier.
+    :param data_point: (float or array-like) datum to evaluate as outlier, or one datum per column of col.
     :param std_dev_limit: (int) the number of standard deviations away from the median a datum must be to be considered
                           an outlier.
     :param min_num_points: (int) the minimum number of non-nan data in col required to perform interquartile statistics.
                            Not enough data results in a False output.
+    :param axis: (int) axis of col along which the statistics are computed.
     
-    :return: (bool) whether the data_point is an outlier (if there is enough data in col).
+    :return: (bool or boolean array) whether the data_point is an outlier (if there is enough data in col).
     """
     
-    q25 = np.nanpercentile(col.astype(float), 25) if sum(~np.isnan(col.astype(float))) >= min_num_points else float('nan')
-    q75 = np.nanpercentile(col.astype(float), 75) if sum(~np.isnan(col.astype(float))) >= min_num_points else float('nan')
-    iqr_stdev = (abs(q75 - q25) / 1.35) if int(sum(np.isnan([q75, q25]))) == 0 else float('nan')
-    cut_off = iqr_stdev * std_dev_limit
-    return (False if math.isnan(cut_off) | math.isnan(data_point) |
-                        ((np.nanmedian(col) - cut_off) < data_point < (np.nanmedian(col) + cut_off)) else True)
+    col = np.asarray(col, dtype=np.float64)
+    data_point = np.asarray(data_point, dtype=np.float64)
+    num_valid = np.sum(~np.isnan(col), axis=axis)
+    enough_data = num_valid >= max(min_num_points, 1)
+
+    # NaNs sort to the end, so the quartiles and median are interpolated from the first num_valid sorted values
+    col = np.moveaxis(np.sort(col, axis=axis), axis, -1)
+    last_valid = np.maximum(num_valid - 1, 0)[..., np.newaxis]
+    positions = last_valid * np.array([0.25, 0.5, 0.75])
+    lower = np.floor(positions).astype(np.intp)
+    lower_values = np.take_along_axis(col, lower, axis=-1)
+    upper_values = np.take_along_axis(col, np.minimum(lower + 1, last_valid), axis=-1)
+    q25, median, q75 = np.moveaxis(lower_values + (upper_values - lower_values) * (positions - lower), -1, 0)
+    cut_off = (q75 - q25) * (std_dev_limit * _INV_IQR_SIGMA)
+    lower_limit = median - cut_off
+    upper_limit = median + cut_off
+    return enough_data & ((data_point <= lower_limit) | (data_point >= upper_limit))  # False for nan data_point